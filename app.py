@@ -1,9 +1,12 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
-from pymongo import MongoClient
-import plotly.express as px
+from pymongo import MongoClient, UpdateOne, DeleteMany
+from pymongo.errors import DuplicateKeyError, OperationFailure
 import hashlib
+import hmac
+import os
+from collections import Counter
 
 # ==============================
 # PAGE CONFIG
@@ -13,22 +16,74 @@ st.set_page_config(page_title="🛍️ Retail Sales Dashboard", layout="wide")
 # ==============================
 # MONGO CONNECTION
 # ==============================
-mongo_uri = st.secrets["mongo"]["uri"]  # <--- from secrets.toml
 db_name = "retail_app"
 coll_users = "users"
 coll_products = "products"
 coll_orders = "orders"
+scrypt_params = {"n": 2**14, "r": 8, "p": 1}
+product_dtypes = {
+    "Product_ID": "int64[pyarrow]",
+    "Product_Name": "string[pyarrow]",
+    "Category": "category",
+    "Price": "int32[pyarrow]",
+    "Rating": "double[pyarrow]",
+    "Sales_Volume": "int32[pyarrow]",
+    "Stock": "int32[pyarrow]",
+    "Revenue": "int64[pyarrow]",
+}
+
+@st.cache_resource
+def init_connection():
+    mongo_uri = st.secrets["mongo"]["uri"]  # <--- from secrets.toml
+    # zstd would need the zstandard package; no socketTimeoutMS so long saves/reads aren't cut off mid-reply
+    client = MongoClient(mongo_uri, minPoolSize=2, maxPoolSize=20, serverSelectionTimeoutMS=5000,
+                         compressors="zlib")
+    client.admin.command("ping")  # open the pool now and fail fast on a bad URI
+    return client
+
+@st.cache_resource
+def get_db_collections():
+    db = init_connection()[db_name]
+    return db[coll_users], db[coll_products], db[coll_orders]
 
 try:
-    client = MongoClient(mongo_uri)
-    db = client[db_name]
-    users_col = db[coll_users]
-    products_col = db[coll_products]
-    orders_col = db[coll_orders]
+    users_col, products_col, orders_col = get_db_collections()
 except Exception as e:
     st.error(f"❌ MongoDB connection failed: {e}")
     st.stop()
 
+def backfill_product_ids():
+    # rows saved by the old editor may have a missing, NaN or duplicate Product_ID
+    docs = list(products_col.find({}, {"Product_ID": 1}).sort("_id", 1))  # oldest copy keeps its ID
+    ids = [d.get("Product_ID") for d in docs]
+    valid = [pid if isinstance(pid, (int, float)) and pd.notna(pid) else None for pid in ids]
+    next_id = int(max((pid for pid in valid if pid is not None), default=0)) + 1
+    seen, ops = set(), []
+    for d, pid in zip(docs, valid):
+        if pid is None or pid in seen:
+            ops.append(UpdateOne({"_id": d["_id"]}, {"$set": {"Product_ID": next_id}}))
+            next_id += 1
+        else:
+            seen.add(pid)
+    if ops:
+        products_col.bulk_write(ops)
+
+@st.cache_resource
+def ensure_indexes():
+    backfill_product_ids()
+    problems = []
+    for coll, keys, unique in [
+        (users_col, "username", True),
+        (products_col, "Product_ID", True),
+    ]:
+        try:
+            coll.create_index(keys, unique=unique)
+        except OperationFailure as e:
+            problems.append(f"{coll.name} {keys}: {e}")
+    return problems
+
+index_problems = ensure_indexes()
+
 # ==============================
 # STYLE
 # ==============================
@@ -45,36 +100,146 @@ st.markdown("""
 # FUNCTIONS
 # ==============================
 def hash_pw(password):
-    return hashlib.sha256(password.encode()).hexdigest()
+    salt = os.urandom(16)
+    digest = hashlib.scrypt(password.encode(), salt=salt, **scrypt_params)
+    n, r, p = scrypt_params["n"], scrypt_params["r"], scrypt_params["p"]
+    return f"scrypt${n}${r}${p}${salt.hex()}${digest.hex()}"
+
+def check_pw(password, stored):
+    if "$" not in stored:  # legacy unsalted sha256
+        return hmac.compare_digest(stored, hashlib.sha256(password.encode()).hexdigest())
+    scheme, *params, salt, digest = stored.split("$")
+    if scheme == "scrypt":
+        n, r, p = map(int, params)
+        derived = hashlib.scrypt(password.encode(), salt=bytes.fromhex(salt), n=n, r=r, p=p)
+    else:  # pbkdf2_sha256$iterations$salt$hash
+        derived = hashlib.pbkdf2_hmac("sha256", password.encode(), bytes.fromhex(salt), int(params[0]))
+    return hmac.compare_digest(derived.hex(), digest)
 
 def verify_user(username, password):
-    user = users_col.find_one({"username": username})
-    if user and user["password"] == hash_pw(password):
+    user = users_col.find_one({"username": username}, {"_id": 0, "username": 1, "password": 1, "role": 1})
+    if user and check_pw(password, user["password"]):
+        if not user["password"].startswith("scrypt$"):
+            users_col.update_one({"username": username}, {"$set": {"password": hash_pw(password)}})
         return user
     return None
 
 def create_user(username, password, role="user"):
-    if users_col.find_one({"username": username}):
+    try:
+        result = users_col.update_one(
+            {"username": username},
+            {"$setOnInsert": {"password": hash_pw(password), "role": role}},
+            upsert=True
+        )
+    except DuplicateKeyError:
         return False
-    users_col.insert_one({"username": username, "password": hash_pw(password), "role": role})
-    return True
+    return result.upserted_id is not None
 
 def add_sample_products():
     np.random.seed(42)
+    n = 20
     categories = ["Clothing", "Shoes", "Accessories", "Electronics"]
-    products = []
-    for i in range(20):
-        products.append({
-            "Product_ID": i + 1,
-            "Product_Name": f"Product_{i+1}",
-            "Category": np.random.choice(categories),
-            "Price": np.random.randint(300, 4000),
-            "Rating": np.random.uniform(2.5, 5.0),
-            "Sales_Volume": np.random.randint(50, 500),
-            "Stock": np.random.randint(10, 100),
-            "Revenue": np.random.randint(20000, 200000)
-        })
-    products_col.insert_many(products)
+    ids = np.arange(1, n + 1)
+    products = pd.DataFrame({
+        "Product_ID": ids,
+        "Product_Name": np.char.add("Product_", ids.astype(str)),
+        "Category": np.random.choice(categories, n),
+        "Price": np.random.randint(300, 4000, n),
+        "Rating": np.random.uniform(2.5, 5.0, n),
+        "Sales_Volume": np.random.randint(50, 500, n),
+        "Stock": np.random.randint(10, 100, n),
+        "Revenue": np.random.randint(20000, 200000, n)
+    })
+    products_col.insert_many(product_records(products))
+
+@st.cache_data(ttl=60)
+def load_products():
+    projection = {**dict.fromkeys(product_dtypes, 1), "_id": 0}
+    cursor = products_col.find({}, projection).batch_size(1000)
+    frame = pd.DataFrame.from_records(cursor, columns=list(product_dtypes))
+    for col, dtype in product_dtypes.items():
+        if dtype.startswith(("int", "double")):
+            # older rows may hold decimals, text or out-of-range numbers here
+            frame[col] = pd.to_numeric(frame[col], errors="coerce")
+            if dtype.startswith("int"):
+                bound = -int(np.iinfo(dtype.split("[")[0]).min)  # 2**31 or 2**63
+                rounded = frame[col].round()
+                frame[col] = rounded.where((rounded >= -bound) & (rounded < bound))
+    return frame.astype(product_dtypes)
+
+@st.cache_data(ttl=60)
+def load_orders():
+    return pd.DataFrame.from_records(orders_col.find({}, {"_id": 0}).batch_size(1000))
+
+@st.cache_data(ttl=60)
+def product_filter_options():
+    df = load_products()
+    prices = df["Price"].dropna()
+    if prices.empty:
+        return sorted(df["Category"].dropna().unique().tolist()), 0, 0
+    return sorted(df["Category"].dropna().unique().tolist()), int(prices.min()), int(prices.max())
+
+@st.cache_data(ttl=60)
+def product_charts():
+    import plotly.express as px  # only the user view draws charts
+
+    df = load_products()
+    fig = px.bar(df, x="Product_Name", y="Revenue", color="Category", title="Revenue per Product")
+    sized = df.dropna(subset=["Rating", "Sales_Volume", "Price"])  # marker size can't be NA
+    fig2 = px.scatter(sized, x="Rating", y="Sales_Volume", size="Price", color="Category",
+                      title="Rating vs Sales Volume", render_mode="webgl")
+    return fig, fig2
+
+@st.cache_data(ttl=60)
+def cart_frame(items):
+    ids, qtys = zip(*items)
+    by_id = load_products().set_index("Product_ID")
+    cart_df = by_id.reindex(list(ids)).assign(Qty=list(qtys))
+    cart_df = cart_df[cart_df.index.isin(by_id.index)].reset_index()
+    cart_df["Total"] = cart_df["Price"] * cart_df["Qty"]
+    return cart_df
+
+def clear_product_caches():
+    load_products.clear()
+    product_filter_options.clear()
+    product_charts.clear()
+    cart_frame.clear()
+
+def product_records(frame):
+    return [{col: None if pd.isna(val) else val for col, val in zip(frame.columns, row)}
+            for row in frame.itertuples(index=False, name=None)]
+
+def save_products(edited, original):
+    ids = edited["Product_ID"].to_numpy(dtype="float64", na_value=np.nan)
+    missing = np.isnan(ids)
+    if missing.any():
+        start = int(np.nanmax(ids)) + 1 if (~missing).any() else 1
+        ids[missing] = np.arange(start, start + missing.sum())
+    edited = edited.assign(Product_ID=ids.astype(int))  # new frame; the caller's is left as is
+
+    before = {r["Product_ID"]: r for r in product_records(original)}
+    records = product_records(edited)
+    ops = [UpdateOne({"Product_ID": r["Product_ID"]}, {"$set": r}, upsert=True)
+           for r in records if before.get(r["Product_ID"]) != r]
+    removed = before.keys() - {r["Product_ID"] for r in records}
+    if removed:
+        ops.append(DeleteMany({"Product_ID": {"$in": list(removed)}}))
+    if ops:
+        try:
+            with init_connection().start_session() as session:
+                session.with_transaction(lambda s: products_col.bulk_write(ops, ordered=False, session=s))
+        except OperationFailure as e:
+            if e.code != 20:  # IllegalOperation: a standalone mongod has no transactions
+                raise
+            products_col.bulk_write(ops, ordered=False)
+    clear_product_caches()
+    ensure_sample_products.clear()  # reseed on the next rerun if the admin emptied the catalog
+
+@st.cache_resource
+def ensure_sample_products():
+    if products_col.find_one({}, {"_id": 1}) is None:
+        add_sample_products()
+        clear_product_caches()
 
 # ==============================
 # LOGIN / SIGNUP
@@ -82,7 +247,7 @@ def add_sample_products():
 if "user" not in st.session_state:
     st.session_state.user = None
 if "cart" not in st.session_state:
-    st.session_state.cart = []
+    st.session_state.cart = Counter()
 
 if not st.session_state.user:
     tab1, tab2 = st.tabs(["🔑 Login", "📝 Sign Up"])
@@ -120,7 +285,7 @@ with col1:
 with col2:
     if st.button("🚪 Logout"):
         st.session_state.user = None
-        st.session_state.cart = []
+        st.session_state.cart = Counter()
         st.rerun()
 
 role = st.session_state.user["role"]
@@ -128,28 +293,26 @@ role = st.session_state.user["role"]
 # ==============================
 # LOAD DATA
 # ==============================
-if products_col.count_documents({}) == 0:
-    add_sample_products()
-
-data = list(products_col.find({}, {"_id": 0}))
-df = pd.DataFrame(data)
+ensure_sample_products()
+df = load_products()
 
 # ==============================
 # ADMIN PANEL
 # ==============================
 if role == "admin":
     st.subheader("⚙️ Admin Panel - Manage Products")
-    edited = st.data_editor(df, num_rows="dynamic")
+    for problem in index_problems:
+        st.warning(f"⚠️ Could not create index on {problem}")
+    edited = st.data_editor(df.astype({"Category": "object"}), num_rows="dynamic")
     if st.button("💾 Save Changes"):
-        products_col.delete_many({})
-        products_col.insert_many(edited.to_dict(orient="records"))
+        save_products(edited, df)
         st.success("✅ Database updated successfully.")
     st.divider()
 
     st.subheader("📦 Purchased Orders")
-    orders = list(orders_col.find({}, {"_id": 0}))
+    orders = load_orders()
     if len(orders) > 0:
-        st.dataframe(pd.DataFrame(orders))
+        st.dataframe(orders)
     else:
         st.info("No purchases yet.")
     st.stop()
@@ -158,37 +321,44 @@ if role == "admin":
 # USER PANEL
 # ==============================
 st.sidebar.header("🔍 Filters")
-cat = st.sidebar.selectbox("Category", ["All"] + sorted(df["Category"].unique().tolist()))
-price = st.sidebar.slider("Price (₹)", int(df["Price"].min()), int(df["Price"].max()), (1000, 3000))
+categories, price_min, price_max = product_filter_options()
+cat = st.sidebar.selectbox("Category", ["All"] + categories)
+price = st.sidebar.slider("Price (₹)", price_min, price_max, (1000, 3000))
 rating = st.sidebar.slider("Min Rating", 0.0, 5.0, 3.0, 0.1)
 
-filtered = df[(df["Price"].between(price[0], price[1])) & (df["Rating"] >= rating)]
+mask = df["Price"].between(price[0], price[1]).to_numpy(bool, na_value=False)
+mask &= df["Rating"].ge(rating).to_numpy(bool, na_value=False)
 if cat != "All":
-    filtered = filtered[filtered["Category"] == cat]
+    mask &= (df["Category"] == cat).to_numpy()
+filtered = df[mask]
 
 st.subheader("🛒 Product Catalog")
 
-for _, row in filtered.iterrows():
-    col1, col2, col3, col4 = st.columns([3, 2, 2, 2])
-    with col1:
-        st.write(f"**{row['Product_Name']}** ({row['Category']})")
-        st.write(f"💰 ₹{row['Price']} | ⭐ {round(row['Rating'],1)}")
-    with col2:
-        st.write(f"Stock: {row['Stock']}")
-    with col3:
-        qty = sum(1 for item in st.session_state.cart if item["Product_Name"] == row["Product_Name"])
-        st.write(f"In Cart: {qty}")
-    with col4:
-        c1, c2 = st.columns(2)
-        with c1:
-            if st.button("➕", key=f"add_{row['Product_Name']}"):
-                st.session_state.cart.append(row.to_dict())
-        with c2:
-            if st.button("➖", key=f"remove_{row['Product_Name']}"):
-                for i, item in enumerate(st.session_state.cart):
-                    if item["Product_Name"] == row["Product_Name"]:
-                        del st.session_state.cart[i]
-                        break
+cart = st.session_state.cart
+for pid in set(cart) - set(df["Product_ID"].tolist()):  # products deleted since they were added
+    del cart[pid]
+catalog = filtered[["Product_ID", "Product_Name", "Category", "Price", "Rating", "Stock"]].assign(
+    **{"In Cart": [cart[pid] for pid in filtered["Product_ID"]]})
+
+with st.form("catalog"):
+    picked = st.data_editor(
+        catalog,
+        hide_index=True,
+        use_container_width=True,
+        column_config={
+            "Product_ID": None,
+            "Rating": st.column_config.NumberColumn(format="⭐ %.1f"),
+            "Price": st.column_config.NumberColumn(format="₹%d"),
+            "In Cart": st.column_config.NumberColumn(min_value=0, step=1),
+        },
+        disabled=["Product_Name", "Category", "Price", "Rating", "Stock"],
+    )
+    if st.form_submit_button("🛒 Update Cart"):
+        for pid, qty in zip(picked["Product_ID"], picked["In Cart"]):
+            if pd.notna(qty) and qty > 0:
+                cart[pid] = int(qty)
+            else:
+                cart.pop(pid, None)
 
 st.divider()
 
@@ -196,13 +366,12 @@ st.divider()
 # CART SECTION
 # ==============================
 st.subheader("🧺 Your Cart")
-if len(st.session_state.cart) == 0:
+cart_df = cart_frame(tuple(cart.items())) if cart else None
+if cart_df is None or cart_df.empty:
     st.info("Cart is empty.")
 else:
-    cart_df = pd.DataFrame(st.session_state.cart)
-    cart_df["Total"] = cart_df["Price"]
-    st.dataframe(cart_df[["Product_Name", "Category", "Price", "Total"]])
-    total = cart_df["Price"].sum()
+    st.dataframe(cart_df[["Product_Name", "Category", "Price", "Qty", "Total"]])
+    total = cart_df["Total"].sum()
     st.markdown(f"### 💳 Total Amount: ₹{total}")
     if st.button("🛍️ Final Purchase"):
         orders_col.insert_one({
@@ -210,17 +379,16 @@ else:
             "cart_items": cart_df.to_dict(orient="records"),
             "total": float(total)
         })
-        st.session_state.cart = []
+        load_orders.clear()
+        st.session_state.cart = Counter()
         st.success("✅ Purchase successful! Your order is now with admin.")
 
 st.divider()
 st.subheader("📊 Visualization")
 
+fig, fig2 = product_charts()
 col1, col2 = st.columns(2)
 with col1:
-    fig = px.bar(df, x="Product_Name", y="Revenue", color="Category", title="Revenue per Product")
     st.plotly_chart(fig, use_container_width=True)
 with col2:
-    fig2 = px.scatter(df, x="Rating", y="Sales_Volume", size="Price", color="Category",
-                      title="Rating vs Sales Volume")
     st.plotly_chart(fig2, use_container_width=True)